@@ -14,12 +14,15 @@
 
 """A sample skeleton vehicle app."""
 import asyncio
-import json
 import logging
 import os
+import queue
 import signal
-from logging.handlers import TimedRotatingFileHandler
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import orjson
 from vehicle import Vehicle, vehicle  # type: ignore
 from velocitas_sdk.util.log import (  # type: ignore
     get_opentelemetry_log_factory,
@@ -28,6 +31,12 @@
 from velocitas_sdk.vdb.reply import DataPointReply
 from velocitas_sdk.vehicle_app import VehicleApp, subscribe_topic
 
+try:
+    import uvloop
+except ImportError:
+    # Fall back to the default asyncio event loop
+    uvloop = None  # type: ignore
+
 # Logger setup
 LOG_PATH = "logs/vehicle/app.log"
 
@@ -60,22 +69,135 @@
 GET_VER_ACCEL_RESPONSE_TOPIC = "sampleapp/getVerticalAccel/response"
 DATABROKER_VER_ACCEL_SUBSCRIPTION_TOPIC = "sampleapp/currentVerticalAccel"
 
+DATABROKER_ACCEL_SUBSCRIPTION_TOPIC = "sampleapp/currentAccel"
+
+# Maximum number of queued messages taken by one publish batch
+PUBLISH_BATCH_SIZE = 32
+
+# Constant (prefix, suffix) parts of the JSON payloads, only the value
+# in between is filled in per message. Numeric values are encoded with orjson,
+# which writes non-finite floats as null, so the payloads stay valid JSON
+_SPEED_EVENT = ('{"speed":', "}")
+_LONGI_ACCEL_EVENT = ('{"longitudinal_acceleration":', "}")
+_LAT_ACCEL_EVENT = ('{"lateral_acceleration":', "}")
+_VER_ACCEL_EVENT = ('{"vertical_acceleration":', "}")
+
+_SPEED_RESP = ('{"result":{"status":0,"message":"Speed = ', '"}}')
+_LONGI_ACCEL_RESP = ('{"result":{"status":0,"message":"Longi Acceleration = ', '"}}')
+_LAT_ACCEL_RESP = ('{"result":{"status":0,"message":"LAT Acceleration = ', '"}}')
+_VER_ACCEL_RESP = ('{"result":{"status":0,"message":"Vertical Acceleration = ', '"}}')
+_VALUE_RESP = ('{"result":{"status":0,"value":', "}}")
+
+
+def env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def encode_json_value(value):
+    return orjson.dumps(value).decode()
+
+
+def parse_log_level(value):
+    """Return the level for a level name (case-insensitive) or number."""
+    value = value.strip().upper()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {value!r}")
+    return level
+
+
+# Get requests are answered with the numeric value by default, set
+# RESPONSE_MESSAGE_TEXT to a true value (1/true/yes/on) to answer with the
+# "<Name> = <value>" message instead
+RESPONSE_MESSAGE_TEXT = env_flag("RESPONSE_MESSAGE_TEXT")
+
 # Configure the VehicleApp logger with the necessary log config and level
 logging.setLogRecordFactory(get_opentelemetry_log_factory())
 logging.basicConfig(format=get_opentelemetry_log_format())
-logging.getLogger().setLevel(logging.DEBUG)
 logger = logging.getLogger(__name__)
+try:
+    logging.getLogger().setLevel(parse_log_level(os.environ.get("LOG_LEVEL", "INFO")))
+except ValueError as error:
+    logging.getLogger().setLevel(logging.INFO)
+    logger.warning("%s, falling back to INFO", error)
+# Skip building the debug records in the request handlers unless enabled. The
+# level is only read at startup, changing it later does not enable them
+_DEBUG = logger.isEnabledFor(logging.DEBUG)
+
+
+class BufferedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """TimedRotatingFileHandler which buffers writes and flushes them lazily.
+
+    The stream is flushed for records of level ERROR and above, and for
+    the first record emitted once flush_interval seconds have passed since
+    the last flush. The interval is only checked on emit, so buffered
+    records stay in memory while no new records arrive until the handler
+    is flushed or closed. Rollover is decided from the cached rollover time
+    only, without touching the file system.
+    """
+
+    def __init__(self, *args, buffer_size=64 * 1024, flush_interval=30.0, **kwargs):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        super().__init__(*args, **kwargs)
+
+    def _open(self):
+        return open(
+            self.baseFilename,
+            self.mode,
+            buffering=self.buffer_size,
+            encoding=self.encoding,
+            errors=self.errors,
+        )
+
+    def shouldRollover(self, record):
+        # Only compare against the cached rollover time, the base class may
+        # additionally stat the log file for every record
+        return time.time() >= self.rolloverAt
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            now = time.monotonic()
+            if (
+                record.levelno >= logging.ERROR
+                or now - self._last_flush > self.flush_interval
+            ):
+                self.flush()
+                self._last_flush = now
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+# Records are only enqueued on the event loop; the file writes happen
+# on the QueueListener thread
+LOG_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+
+# All loggers write to the same file, so they share one file handler and
+# one queue handler feeding it
+_SHARED_HANDLER = BufferedTimedRotatingFileHandler(
+    filename=LOG_PATH, when="s", interval=60, backupCount=5, encoding="utf-8"
+)
+_SHARED_HANDLER.setFormatter(logging.Formatter(LOG_FORMAT))
+_QUEUE_HANDLER = QueueHandler(LOG_QUEUE)
 
 
 # Helper function to set up loggers
 def setup_accel_logger(logger_name):
-    log_handler = TimedRotatingFileHandler(
-        filename=LOG_PATH, when="s", interval=60, backupCount=5, encoding="utf-8"
-    )
-    log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
     logger = logging.getLogger(logger_name)
-    logger.addHandler(log_handler)
+    logger.addHandler(_QUEUE_HANDLER)
     logger.setLevel(logging.INFO)
+    # The records are only meant for the log file, not the root handler
+    logger.propagate = False
     return logger
 
 
@@ -85,141 +207,236 @@ def setup_accel_logger(logger_name):
 LatAccelLogger = setup_accel_logger(LAT_ACCEL_LOGGER_NAME)
 VerAccelLogger = setup_accel_logger(VER_ACCEL_LOGGER_NAME)
 
+LOG_LISTENER = QueueListener(LOG_QUEUE, _SHARED_HANDLER, respect_handler_level=True)
+
 
 class SampleApp(VehicleApp):
+    # Slot descriptors for the attributes read on the hot paths. VehicleApp
+    # has no __slots__, so instances still keep a __dict__ for its state and
+    # only the attribute access gets faster, not the instance smaller
+    __slots__ = (
+        "vehicle",
+        "_dp_speed",
+        "_dp_long",
+        "_dp_lat",
+        "_dp_ver",
+        "_tx_q",
+        "_pub",
+        "_pub_task",
+    )
+
     def __init__(self, vehicle_client: Vehicle):
         super().__init__()
         self.vehicle = vehicle_client
+        # Resolve the datapoints once instead of on every callback
+        self._dp_speed = vehicle_client.Speed
+        self._dp_long = vehicle_client.Acceleration.Longitudinal
+        self._dp_lat = vehicle_client.Acceleration.Lateral
+        self._dp_ver = vehicle_client.Acceleration.Vertical
+        # Outgoing (topic, payload) messages, published by a background task
+        self._tx_q: asyncio.Queue[Tuple[str, str]] = asyncio.Queue(maxsize=1024)
+        self._pub_task: Optional[asyncio.Task] = None
+        self._pub = self._publish_nowait
 
     async def on_start(self):
-        await self.vehicle.Speed.subscribe(self.on_speed_change)
-        await self.vehicle.Acceleration.Longitudinal.subscribe(self.on_accel_change)
-        await self.vehicle.Acceleration.Lateral.subscribe(self.on_accel_change)
-        await self.vehicle.Acceleration.Vertical.subscribe(self.on_accel_change)
-        
-
-    async def on_speed_change(self, data: DataPointReply):
-        vehicle_speed = data.get(self.vehicle.Speed).value
-        SpeedLogger.info("Vehicle speed: %s", vehicle_speed)
-        await self.publish_event(
-            DATABROKER_SPEED_SUBSCRIPTION_TOPIC, json.dumps({"speed": vehicle_speed})
+        self._pub_task = asyncio.create_task(self._drain())
+        await self._dp_speed.subscribe(self.on_speed_change)
+        # One subscription for all axes, so each reply carries all three
+        # acceleration values and triggers a single callback. join() sets the
+        # SDK's shared query context, so it must not run before the speed
+        # subscription is built
+        await self._dp_long.join(self._dp_lat, self._dp_ver).subscribe(
+            self.on_accel_change
         )
 
-    async def on_accel_change(self, data: DataPointReply):
-        vehicle_longi_accel = data.get(self.vehicle.Acceleration.Longitudinal).value
-        vehicle_lat_acceleration = data.get(self.vehicle.Acceleration.Lateral).value
-        vehicle_ver_acceleration = data.get(self.vehicle.Acceleration.Vertical).value
+    async def _drain(self):
+        while True:
+            # Wait for the next message, then take whatever else is already
+            # queued. Topics are published concurrently, the messages of one
+            # topic one after the other to keep their order
+            batch = [await self._tx_q.get()]
+            batch.extend(
+                self._tx_q.get_nowait()
+                for _ in range(min(self._tx_q.qsize(), PUBLISH_BATCH_SIZE - 1))
+            )
+            payloads_by_topic: Dict[str, List[str]] = {}
+            for topic, payload in batch:
+                payloads_by_topic.setdefault(topic, []).append(payload)
+            await asyncio.gather(
+                *(
+                    self._publish_in_order(topic, payloads)
+                    for topic, payloads in payloads_by_topic.items()
+                )
+            )
 
-        LongiAccelLogger.info(
-            "Vehicle longitudinal acceleration: %s", vehicle_longi_accel
-        )
-        LatAccelLogger.info(
-            "Vehicle lateral acceleration: %s", vehicle_lat_acceleration
-        )
-        VerAccelLogger.info(
-            "Vehicle vertical acceleration: %s", vehicle_ver_acceleration
-        )
+    async def _publish_in_order(self, topic: str, payloads: List[str]):
+        for payload in payloads:
+            try:
+                await self.publish_event(topic, payload)
+            except Exception as error:
+                logger.error("Failed to publish to topic %s: %s", topic, error)
 
-        # Publish each acceleration value to its respective topic
-        await self.publish_event(
-            DATABROKER_LONGI_ACCEL_SUBSCRIPTION_TOPIC,
-            json.dumps({"longitudinal_acceleration": vehicle_longi_accel}),
-        )
-        await self.publish_event(
-            DATABROKER_LAT_ACCEL_SUBSCRIPTION_TOPIC,
-            json.dumps({"lateral_acceleration": vehicle_lat_acceleration}),
-        )
-        await self.publish_event(
-            DATABROKER_VER_ACCEL_SUBSCRIPTION_TOPIC,
-            json.dumps({"vertical_acceleration": vehicle_ver_acceleration}),
-        )
+    def _publish_nowait(self, topic: str, payload: str):
+        try:
+            self._tx_q.put_nowait((topic, payload))
+        except asyncio.QueueFull:
+            # Drop the oldest message in favour of the latest one
+            self._tx_q.get_nowait()
+            self._tx_q.put_nowait((topic, payload))
 
-    @subscribe_topic(GET_SPEED_REQUEST_TOPIC)
-    async def on_get_speed_request_received(self, data: str):
-        logger.debug(
-            "Received speed request on topic %s with data: %s",
-            GET_SPEED_REQUEST_TOPIC,
-            data,
-        )
-        vehicle_speed = (await self.vehicle.Speed.get()).value
-        await self.publish_event(
-            GET_SPEED_RESPONSE_TOPIC,
-            json.dumps(
-                {"result": {"status": 0, "message": f"Speed = {vehicle_speed}"}}
-            ),
-        )
+    async def on_speed_change(
+        self,
+        data: DataPointReply,
+        _logger=SpeedLogger,
+        _pub_topic=DATABROKER_SPEED_SUBSCRIPTION_TOPIC,
+        _tmpl=_SPEED_EVENT,
+        _dumps=orjson.dumps,
+    ):
+        vehicle_speed = data.get(self._dp_speed).value
+        _logger.info("Vehicle speed: %s", vehicle_speed)
+        self._pub(_pub_topic, f"{_tmpl[0]}{_dumps(vehicle_speed).decode()}{_tmpl[1]}")
 
-    @subscribe_topic(GET_LONGI_ACCEL_REQUEST_TOPIC)
-    async def on_get_longi_accel_request_received(self, data: str):
-        logger.debug(
-            "Received longitudinal acceleration request on topic %s with data: %s",
-            GET_LONGI_ACCEL_REQUEST_TOPIC,
-            data,
-        )
-        vehicle_longi_accel = (await self.vehicle.Acceleration.Longitudinal.get()).value
-        await self.publish_event(
-            GET_LONGI_ACCEL_RESPONSE_TOPIC,
-            json.dumps(
-                {
-                    "result": {
-                        "status": 0,
-                        "message": f"Longi Acceleration = {vehicle_longi_accel}",
-                    }
-                }
-            ),
-        )
+    async def on_accel_change(
+        self,
+        data: DataPointReply,
+        _lg_long=LongiAccelLogger,
+        _lg_lat=LatAccelLogger,
+        _lg_ver=VerAccelLogger,
+        _dumps=orjson.dumps,
+        _accel_topic=DATABROKER_ACCEL_SUBSCRIPTION_TOPIC,
+        _long_topic=DATABROKER_LONGI_ACCEL_SUBSCRIPTION_TOPIC,
+        _lat_topic=DATABROKER_LAT_ACCEL_SUBSCRIPTION_TOPIC,
+        _ver_topic=DATABROKER_VER_ACCEL_SUBSCRIPTION_TOPIC,
+        _long_tmpl=_LONGI_ACCEL_EVENT,
+        _lat_tmpl=_LAT_ACCEL_EVENT,
+        _ver_tmpl=_VER_ACCEL_EVENT,
+    ):
+        # Hot path: loggers, topics and helpers are bound as defaults and
+        # locals so they are not looked up in the globals or on self for
+        # every sample
+        pub = self._pub
+        get = data.get
+        vehicle_longi_accel = get(self._dp_long).value
+        vehicle_lat_acceleration = get(self._dp_lat).value
+        vehicle_ver_acceleration = get(self._dp_ver).value
 
-    @subscribe_topic(GET_LAT_ACCEL_REQUEST_TOPIC)
-    async def on_get_lat_accel_request_received(self, data: str):
-        logger.debug(
-            "Received lateral acceleration request on topic %s with data: %s",
-            GET_LAT_ACCEL_REQUEST_TOPIC,
-            data,
-        )
-        vehicle_lat_accel = (await self.vehicle.Acceleration.Lateral.get()).value
-        await self.publish_event(
-            GET_LAT_ACCEL_RESPONSE_TOPIC,
-            json.dumps(
-                {
-                    "result": {
-                        "status": 0,
-                        "message": f"LAT Acceleration = {vehicle_lat_accel}",
-                    }
-                }
-            ),
-        )
+        _lg_long.info("Vehicle longitudinal acceleration: %s", vehicle_longi_accel)
+        _lg_lat.info("Vehicle lateral acceleration: %s", vehicle_lat_acceleration)
+        _lg_ver.info("Vehicle vertical acceleration: %s", vehicle_ver_acceleration)
 
-    @subscribe_topic(GET_VER_ACCEL_REQUEST_TOPIC)
-    async def on_get_ver_accel_request_received(self, data: str):
-        logger.debug(
-            "Received vertical acceleration request on topic %s with data: %s",
-            GET_VER_ACCEL_REQUEST_TOPIC,
-            data,
-        )
-        vehicle_ver_accel = (await self.vehicle.Acceleration.Vertical.get()).value
-        await self.publish_event(
-            GET_VER_ACCEL_RESPONSE_TOPIC,
-            json.dumps(
+        # Publish all acceleration values in one message and each value to its
+        # respective topic
+        pub(
+            _accel_topic,
+            _dumps(
                 {
-                    "result": {
-                        "status": 0,
-                        "message": f"Vertical Acceleration = {vehicle_ver_accel}",
-                    }
+                    "longitudinal": vehicle_longi_accel,
+                    "lateral": vehicle_lat_acceleration,
+                    "vertical": vehicle_ver_acceleration,
                 }
-            ),
+            ).decode(),
         )
+        longi_json = _dumps(vehicle_longi_accel).decode()
+        lat_json = _dumps(vehicle_lat_acceleration).decode()
+        ver_json = _dumps(vehicle_ver_acceleration).decode()
+        pub(_long_topic, f"{_long_tmpl[0]}{longi_json}{_long_tmpl[1]}")
+        pub(_lat_topic, f"{_lat_tmpl[0]}{lat_json}{_lat_tmpl[1]}")
+        pub(_ver_topic, f"{_ver_tmpl[0]}{ver_json}{_ver_tmpl[1]}")
+
+
+# Request handlers generated from the table below, registered on SampleApp
+# under the given method name so that VehicleApp subscribes to their topics
+# (method name, request topic, response topic, description, datapoint
+#  attribute, message response template)
+_GET_REQUESTS = [
+    (
+        "on_get_speed_request_received",
+        GET_SPEED_REQUEST_TOPIC,
+        GET_SPEED_RESPONSE_TOPIC,
+        "speed",
+        "_dp_speed",
+        _SPEED_RESP,
+    ),
+    (
+        "on_get_longi_accel_request_received",
+        GET_LONGI_ACCEL_REQUEST_TOPIC,
+        GET_LONGI_ACCEL_RESPONSE_TOPIC,
+        "longitudinal acceleration",
+        "_dp_long",
+        _LONGI_ACCEL_RESP,
+    ),
+    (
+        "on_get_lat_accel_request_received",
+        GET_LAT_ACCEL_REQUEST_TOPIC,
+        GET_LAT_ACCEL_RESPONSE_TOPIC,
+        "lateral acceleration",
+        "_dp_lat",
+        _LAT_ACCEL_RESP,
+    ),
+    (
+        "on_get_ver_accel_request_received",
+        GET_VER_ACCEL_REQUEST_TOPIC,
+        GET_VER_ACCEL_RESPONSE_TOPIC,
+        "vertical acceleration",
+        "_dp_ver",
+        _VER_ACCEL_RESP,
+    ),
+]
+
 
-    # Add similar methods for lateral and vertical acceleration requests
+def make_get_request_handler(
+    request_topic, response_topic, description, datapoint_attr, template
+):
+    encode: Callable[[Any], str] = str
+    if not RESPONSE_MESSAGE_TEXT:
+        template = _VALUE_RESP
+        encode = encode_json_value
+
+    @subscribe_topic(request_topic)
+    async def on_get_request_received(self, data: str):
+        if _DEBUG:
+            logger.debug(
+                "Received %s request on topic %s with data: %s",
+                description,
+                request_topic,
+                data,
+            )
+        value = (await getattr(self, datapoint_attr).get()).value
+        self._pub(response_topic, f"{template[0]}{encode(value)}{template[1]}")
+
+    return on_get_request_received
+
+
+def register_get_request_handlers(app_class):
+    for name, *handler_args in _GET_REQUESTS:
+        setattr(app_class, name, make_get_request_handler(*handler_args))
+
+
+register_get_request_handlers(SampleApp)
 
 
 # Remaining async main and loop setup
 async def main():
     logger.info("Starting SampleApp...")
-    vehicle_app = SampleApp(vehicle)
-    await vehicle_app.run()
+    # Cancel the app on SIGTERM, asyncio.run then shuts the loop down cleanly
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel  # type: ignore[union-attr]
+    )
+    try:
+        LOG_LISTENER.start()
+        vehicle_app = SampleApp(vehicle)
+        await vehicle_app.run()
+    except asyncio.CancelledError:
+        logger.info("Stopping SampleApp...")
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        LOG_LISTENER.stop()
+        # Write out the records still buffered by the file handler
+        _SHARED_HANDLER.close()
 
 
-LOOP = asyncio.get_event_loop()
-LOOP.add_signal_handler(signal.SIGTERM, LOOP.stop)
-LOOP.run_until_complete(main())
-LOOP.close()
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
+    asyncio.run(main())
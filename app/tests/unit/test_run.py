@@ -14,95 +14,59 @@
 
 # skip B101
 
+import asyncio
+import json
+import logging
+import math
+import queue
+import signal
+import uuid
+from logging.handlers import QueueHandler, QueueListener
 from unittest import mock
 
+import main  # type: ignore
 import pytest
 from google.protobuf.timestamp_pb2 import Timestamp
 from vehicle import vehicle  # type: ignore
 from velocitas_sdk.vdb.types import TypedDataPointResult
 from velocitas_sdk.vehicle_app import VehicleApp
 
-MOCKED_SPEED = 0.0
-MOCKED_LONGI_ACCEL = 0.0
-MOCKED_LAT_ACCEL = 0.0
-MOCKED_VER_ACCEL = 0.0
+MOCKED_SPEED = 50.0
+MOCKED_LONGI_ACCEL = 1.5
+MOCKED_LAT_ACCEL = -0.75
+MOCKED_VER_ACCEL = 9.81
 
 
-@pytest.mark.asyncio
-async def test_for_get_speed():
-    result = TypedDataPointResult("foo", MOCKED_SPEED, Timestamp(seconds=10, nanos=0))
-
-    with mock.patch.object(
-        vehicle.Speed,
-        "get",
-        new_callable=mock.AsyncMock,
-        return_value=result,
-    ):
-        current_speed = (await vehicle.Speed.get()).value
-        print(f"Received speed: {current_speed}")
-        # Uncomment to test the behaviour of the SampleApp as provided by
-        #     the template repository:
-        # assert current_speed == MOCKED_SPEED
+@pytest.fixture
+def app():
+    # Skip the middleware setup of VehicleApp, publish_event is mocked per test
+    with mock.patch.object(VehicleApp, "__init__", return_value=None):
+        yield main.SampleApp(vehicle)
 
 
-@pytest.mark.asyncio
-async def test_for_get_longi_acceleration():
-    result = TypedDataPointResult(
-        "foo", MOCKED_LONGI_ACCEL, Timestamp(seconds=10, nanos=0)
+def datapoint_reply(values):
+    reply = mock.Mock()
+    reply.get.side_effect = lambda datapoint: next(
+        TypedDataPointResult("foo", value, Timestamp(seconds=10, nanos=0))
+        for dp, value in values
+        if dp is datapoint
     )
+    return reply
 
-    with mock.patch.object(
-        vehicle.Acceleration.Longitudinal,
-        "get",
-        new_callable=mock.AsyncMock,
-        return_value=result,
-    ):
-        current_longi_acceleration = (
-            await vehicle.Acceleration.Longitudinal.get()
-        ).value
-        print(f"Received Longitudinal acceleration: {current_longi_acceleration}")
-        # Uncomment to test the behaviour of the SampleApp as provided by
-        #     the template repository:
-        # assert current_longi_acceleration == MOCKED_ACCELERATION
 
+async def wait_until(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0)
+    raise AssertionError("Condition not met")
 
-async def test_for_get_lateral_acceleration():
-    result = TypedDataPointResult(
-        "foo", MOCKED_LAT_ACCEL, Timestamp(seconds=10, nanos=0)
-    )
 
-    with mock.patch.object(
-        vehicle.Acceleration.Lateral,
-        "get",
-        new_callable=mock.AsyncMock,
-        return_value=result,
-    ):
-        current_lateral_acceleration = (await vehicle.Acceleration.Lateral.get()).value
-        print(f"Received Lateral acceleration: {current_lateral_acceleration}")
-        # Uncomment to test the behaviour of the SampleApp as provided by
-        #     the template repository:
-        # assert current_lateral_acceleration == MOCKED_LAT_ACCEL
-
-
-@pytest.mark.asyncio
-async def test_for_get_vertical_acceleration():
-    result = TypedDataPointResult(
-        "foo", MOCKED_VER_ACCEL, Timestamp(seconds=10, nanos=0)
-    )
-
-    with mock.patch.object(
-        vehicle.Acceleration.Vertical,
-        "get",
-        new_callable=mock.AsyncMock,
-        return_value=result,
-    ):
-        current_vertical_acceleration = (
-            await vehicle.Acceleration.Vertical.get()
-        ).value
-        print(f"Received Vertical acceleration: {current_vertical_acceleration}")
-        # Uncomment to test the behaviour of the SampleApp as provided by
-        #     the template repository:
-        # assert current_vertical_acceleration == MOCKED_VER_ACCEL
+def queued_messages(app):
+    messages = []
+    while not app._tx_q.empty():
+        messages.append(app._tx_q.get_nowait())
+    return messages
 
 
 @pytest.mark.asyncio
@@ -129,3 +93,295 @@ def get_sample_response_data():
             "Ver_Accel_message": f"""Vertical Accel= {MOCKED_VER_ACCEL}""",
         },
     }
+
+
+def test_log_record_is_written_once(tmp_path):
+    message = f"record {uuid.uuid4()}"
+    log_path = tmp_path / "app.log"
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    file_handler = main.BufferedTimedRotatingFileHandler(
+        filename=log_path, when="s", interval=60, backupCount=5, encoding="utf-8"
+    )
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    test_logger = logging.getLogger(f"vehicle/test/{uuid.uuid4()}")
+    test_logger.addHandler(QueueHandler(log_queue))
+    test_logger.setLevel(logging.INFO)
+    test_logger.propagate = False
+
+    listener.start()
+    try:
+        test_logger.info(message)
+    finally:
+        listener.stop()
+        file_handler.close()
+
+    assert log_path.read_text(encoding="utf-8").count(message) == 1
+
+
+@pytest.mark.asyncio
+async def test_non_finite_speed_is_published_as_null(app):
+    await app.on_speed_change(datapoint_reply([(app._dp_speed, math.nan)]))
+
+    [(topic, payload)] = queued_messages(app)
+    assert topic == main.DATABROKER_SPEED_SUBSCRIPTION_TOPIC
+    assert json.loads(payload) == {"speed": None}
+
+
+@pytest.mark.asyncio
+async def test_non_finite_acceleration_is_published_as_null(app):
+    await app.on_accel_change(
+        datapoint_reply(
+            [(app._dp_long, 1.5), (app._dp_lat, -0.5), (app._dp_ver, math.nan)]
+        )
+    )
+
+    messages = {topic: json.loads(payload) for topic, payload in queued_messages(app)}
+    assert messages == {
+        main.DATABROKER_ACCEL_SUBSCRIPTION_TOPIC: {
+            "longitudinal": 1.5,
+            "lateral": -0.5,
+            "vertical": None,
+        },
+        main.DATABROKER_LONGI_ACCEL_SUBSCRIPTION_TOPIC: {
+            "longitudinal_acceleration": 1.5
+        },
+        main.DATABROKER_LAT_ACCEL_SUBSCRIPTION_TOPIC: {"lateral_acceleration": -0.5},
+        main.DATABROKER_VER_ACCEL_SUBSCRIPTION_TOPIC: {"vertical_acceleration": None},
+    }
+
+
+@pytest.mark.asyncio
+async def test_main_stops_logging_when_app_creation_fails():
+    with mock.patch.object(main, "LOG_LISTENER") as listener, mock.patch.object(
+        main, "_SHARED_HANDLER"
+    ) as file_handler, mock.patch.object(
+        main, "SampleApp", side_effect=RuntimeError("no middleware")
+    ):
+        with pytest.raises(RuntimeError):
+            await main.main()
+
+    listener.stop.assert_called_once()
+    file_handler.close.assert_called_once()
+    # The SIGTERM handler is removed again, so it cannot cancel a later task
+    assert not asyncio.get_running_loop().remove_signal_handler(signal.SIGTERM)
+
+
+def test_hot_path_attributes_are_stored_in_slots(app):
+    assert set(main.SampleApp.__slots__).isdisjoint(vars(app))
+    assert app._dp_speed is vehicle.Speed
+
+
+@pytest.mark.asyncio
+async def test_on_start_subscribes_speed_and_joined_acceleration(app):
+    with mock.patch("velocitas_sdk.model.VdbSubscription") as subscription, mock.patch(
+        "velocitas_sdk.model.SubscriptionManager"
+    ), mock.patch("velocitas_sdk.model.VehicleDataBrokerClient"):
+        await app.on_start()
+    app._pub_task.cancel()
+
+    assert [call.args[1] for call in subscription.call_args_list] == [
+        "SELECT Vehicle.Speed",
+        "SELECT Vehicle.Acceleration.Longitudinal, "
+        "Vehicle.Acceleration.Lateral, Vehicle.Acceleration.Vertical",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_publish_drops_oldest_message_when_queue_is_full(app):
+    app._tx_q = asyncio.Queue(maxsize=2)
+
+    app._publish_nowait("topic/a", "1")
+    app._publish_nowait("topic/b", "2")
+    app._publish_nowait("topic/c", "3")
+
+    assert queued_messages(app) == [("topic/b", "2"), ("topic/c", "3")]
+
+
+@pytest.mark.asyncio
+async def test_drain_publishes_queued_messages_in_one_batch(app):
+    release = asyncio.Event()
+
+    async def publish(_topic, _payload):
+        await release.wait()
+
+    with mock.patch.object(app, "publish_event", side_effect=publish) as publish_event:
+        for topic in ("topic/a", "topic/b", "topic/c"):
+            app._publish_nowait(topic, "{}")
+        drain = asyncio.create_task(app._drain())
+        try:
+            # All queued messages are being published before the first completes
+            await wait_until(lambda: publish_event.await_count == 3)
+            release.set()
+            await wait_until(app._tx_q.empty)
+        finally:
+            drain.cancel()
+
+    assert [c.args[0] for c in publish_event.await_args_list] == [
+        "topic/a",
+        "topic/b",
+        "topic/c",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_drain_continues_after_failed_publish(app):
+    with mock.patch.object(
+        app,
+        "publish_event",
+        new_callable=mock.AsyncMock,
+        side_effect=[RuntimeError("broker unavailable"), None],
+    ) as publish_event, mock.patch.object(main.logger, "error") as log_error:
+        drain = asyncio.create_task(app._drain())
+        try:
+            app._publish_nowait("topic/a", "1")
+            await wait_until(lambda: publish_event.await_count == 1)
+            app._publish_nowait("topic/a", "2")
+            await wait_until(lambda: publish_event.await_count == 2)
+            assert not drain.done()
+        finally:
+            drain.cancel()
+
+    publish_event.assert_awaited_with("topic/a", "2")
+    log_error.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_drain_keeps_message_order_per_topic(app):
+    release = asyncio.Event()
+
+    async def publish(_topic, _payload):
+        await release.wait()
+
+    with mock.patch.object(app, "publish_event", side_effect=publish) as publish_event:
+        app._publish_nowait("topic/a", "1")
+        app._publish_nowait("topic/a", "2")
+        app._publish_nowait("topic/b", "3")
+        drain = asyncio.create_task(app._drain())
+        try:
+            await wait_until(lambda: publish_event.await_count == 2)
+            # The second message of topic/a waits for the first one
+            for _ in range(10):
+                await asyncio.sleep(0)
+            assert publish_event.await_count == 2
+            release.set()
+            await wait_until(lambda: publish_event.await_count == 3)
+        finally:
+            drain.cancel()
+
+    assert [c.args for c in publish_event.await_args_list] == [
+        ("topic/a", "1"),
+        ("topic/b", "3"),
+        ("topic/a", "2"),
+    ]
+
+
+def test_get_request_handlers_are_registered():
+    handlers = {
+        name: method.subscribeTopic
+        for name, method in vars(main.SampleApp).items()
+        if hasattr(method, "subscribeTopic")
+    }
+
+    assert handlers == {
+        "on_get_speed_request_received": "sampleapp/getSpeed",
+        "on_get_longi_accel_request_received": "sampleapp/getLongitudinalAccel",
+        "on_get_lat_accel_request_received": "sampleapp/getLateralAccel",
+        "on_get_ver_accel_request_received": "sampleapp/getVerticalAccel",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "handler_name, get_datapoint, mocked_value, response_topic",
+    [
+        (
+            "on_get_speed_request_received",
+            lambda: vehicle.Speed,
+            MOCKED_SPEED,
+            "sampleapp/getSpeed/response",
+        ),
+        (
+            "on_get_longi_accel_request_received",
+            lambda: vehicle.Acceleration.Longitudinal,
+            MOCKED_LONGI_ACCEL,
+            "sampleapp/getLongitudinalAccel/response",
+        ),
+        (
+            "on_get_lat_accel_request_received",
+            lambda: vehicle.Acceleration.Lateral,
+            MOCKED_LAT_ACCEL,
+            "sampleapp/getLateralAccel/response",
+        ),
+        (
+            "on_get_ver_accel_request_received",
+            lambda: vehicle.Acceleration.Vertical,
+            MOCKED_VER_ACCEL,
+            "sampleapp/getVerticalAccel/response",
+        ),
+    ],
+)
+async def test_get_request_publishes_response(
+    app, handler_name, get_datapoint, mocked_value, response_topic
+):
+    result = TypedDataPointResult("foo", mocked_value, Timestamp(seconds=10, nanos=0))
+
+    with mock.patch.object(
+        get_datapoint(), "get", new_callable=mock.AsyncMock, return_value=result
+    ):
+        await getattr(app, handler_name)("{}")
+
+    [(topic, payload)] = queued_messages(app)
+    assert topic == response_topic
+    assert json.loads(payload) == {"result": {"status": 0, "value": mocked_value}}
+
+
+@pytest.mark.parametrize(
+    "env_value, expected",
+    [("1", True), ("true", True), ("Yes", True), ("on", True), ("0", False)],
+)
+def test_env_flag(monkeypatch, env_value, expected):
+    monkeypatch.setenv("RESPONSE_MESSAGE_TEXT", env_value)
+
+    assert main.env_flag("RESPONSE_MESSAGE_TEXT") is expected
+
+
+@pytest.mark.parametrize(
+    "env_value, expected",
+    [("DEBUG", 10), ("info", 20), (" Warning ", 30), ("5", 5)],
+)
+def test_parse_log_level(env_value, expected):
+    assert main.parse_log_level(env_value) == expected
+
+
+@pytest.mark.parametrize("env_value", ["", "verbose", "-1", "1.5"])
+def test_parse_log_level_rejects_unknown_values(env_value):
+    with pytest.raises(ValueError):
+        main.parse_log_level(env_value)
+
+
+@pytest.mark.asyncio
+async def test_get_request_publishes_non_finite_value_as_null(app):
+    result = TypedDataPointResult("foo", math.inf, Timestamp(seconds=10, nanos=0))
+
+    with mock.patch.object(
+        vehicle.Speed, "get", new_callable=mock.AsyncMock, return_value=result
+    ):
+        await app.on_get_speed_request_received("{}")
+
+    [(_, payload)] = queued_messages(app)
+    assert json.loads(payload) == {"result": {"status": 0, "value": None}}
+
+
+@pytest.mark.asyncio
+async def test_get_request_publishes_text_message_when_enabled(app):
+    result = TypedDataPointResult("foo", 12.5, Timestamp(seconds=10, nanos=0))
+    with mock.patch.object(main, "RESPONSE_MESSAGE_TEXT", True):
+        handler = main.make_get_request_handler(*main._GET_REQUESTS[0][1:])
+
+    with mock.patch.object(
+        vehicle.Speed, "get", new_callable=mock.AsyncMock, return_value=result
+    ):
+        await handler(app, "{}")
+
+    [(_, payload)] = queued_messages(app)
+    assert json.loads(payload) == {"result": {"status": 0, "message": "Speed = 12.5"}}